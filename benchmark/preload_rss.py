@@ -0,0 +1,98 @@
+"""Compare gunicorn startup time and memory with and without preload_app.
+
+Usage (from project root, with virtual env activated):
+    python benchmark/preload_rss.py --workers 4 --output preload_rss.json
+
+For every mode gunicorn is started with gunicorn.py config, time until
+first successful request is measured and then RSS and PSS of master and
+workers are read from /proc (Linux only). PSS splits pages shared
+copy-on-write between processes, so it shows real memory saved by preload.
+"""
+from typing import Dict, List
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def _read_memory_kb(pid: int) -> Dict[str, int]:
+    memory = {"rss_kb": 0, "pss_kb": 0}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            key, value = line.split(":", 1)
+            if key in ("Rss", "Pss"):
+                memory[f"{key.lower()}_kb"] = int(value.split()[0])
+    return memory
+
+
+def _children(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as children:
+        return [int(child) for child in children.read().split()]
+
+
+def run_mode(preload: bool, workers: int, port: int, timeout: float) -> Dict:
+    env = dict(os.environ, preload_app="true" if preload else "false", debug="false")
+    # gunicorn.py config in project root shadows package, so "python -m gunicorn" can not be used
+    command = [
+        os.path.join(os.path.dirname(sys.executable), "gunicorn"), "--config", "gunicorn.py",
+        "--workers", str(workers), "--bind", f"127.0.0.1:{port}",
+        "--access-logfile", "/dev/null", "--error-logfile", "-",
+        "main:app",
+    ]
+    started = time.perf_counter()
+    master = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = None
+        while time.perf_counter() - started < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/docs", timeout=1)
+                ready = time.perf_counter() - started
+                break
+            except OSError:
+                time.sleep(0.05)
+        if ready is None:
+            raise RuntimeError(f"gunicorn not ready after {timeout}s (preload={preload})")
+        # wait until all workers booted, not only first one
+        while len(_children(master.pid)) < workers and time.perf_counter() - started < timeout:
+            time.sleep(0.05)
+        time.sleep(1)
+        master_memory = _read_memory_kb(master.pid)
+        workers_memory = [_read_memory_kb(pid) for pid in _children(master.pid)]
+        return {
+            "preload_app": preload,
+            "workers": len(workers_memory),
+            "first_response_seconds": round(ready, 3),
+            "master": master_memory,
+            "workers_rss_kb": sum(memory["rss_kb"] for memory in workers_memory),
+            "workers_pss_kb": sum(memory["pss_kb"] for memory in workers_memory),
+            "total_pss_kb": master_memory["pss_kb"] + sum(memory["pss_kb"] for memory in workers_memory),
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8499)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", default=None, help="JSON file with results, printed to stdout if not set")
+    args = parser.parse_args()
+    results = [run_mode(preload, args.workers, args.port, args.timeout) for preload in (False, True)]
+    report = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
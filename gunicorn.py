@@ -1,5 +1,6 @@
 import multiprocessing
 import os
+import shutil
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -19,5 +20,19 @@ keepalive = 2
 
 debug = os.environ.get("debug", "false") == "true"
 reload = debug
-preload_app = False
+# with preload master imports app once and workers share it copy-on-write, code reload needs it disabled
+preload_app = not reload and os.environ.get("preload_app", "false") == "true"
 daemon = False
+
+
+# Prometheus metrics from all workers are aggregated in PROMETHEUS_MULTIPROC_DIR (see lib/metrics.py)
+def on_starting(server):
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from fastapi import HTTPException
+import contextvars
+import os
+import sentry_sdk
+import threading
+from lib.idempotency import idempotency_cache
+from lib import metrics, profiler, tracing
+import models
+
+
+BATCH_WORKERS = int(os.environ.get("batch_workers", "4"))
+BATCH_CARRIER_WORKERS = int(os.environ.get("batch_carrier_workers", "2"))
+BATCH_MAX_SIZE = int(os.environ.get("batch_max_size", "500"))
+_carrier_lock = threading.Lock()
+
+
+def error_to_confirmation(error: Exception) -> models.ShipmentConfirmation:
+    """Convert exception raised by Exporter to shipment confirmation
+
+    Args:
+        error (Exception): Exception raised during shipment processing
+
+    Returns:
+        models.ShipmentConfirmation: Confirmation with error description
+    """
+    if not isinstance(error, HTTPException):
+        sentry_sdk.capture_exception(error)
+        return models.ShipmentConfirmation(status=500, result_code="Error", message=str(error))
+    detail = error.detail
+    if isinstance(detail, dict) and 'model' in detail:
+        return models.ShipmentConfirmation(**detail['model'])
+    if isinstance(detail, dict):
+        detail = detail.get('error_description', detail)
+    return models.ShipmentConfirmation(status=error.status_code, result_code="Error", message=str(detail))
+
+
+def _send_shipment(shipment_id: str, carrier_limits: Dict[str, threading.Semaphore], carrier_limit: int) -> models.ShipmentConfirmation:
+    """Create Exporter and send shipment in one task, so Jeeves connections and carrier
+    session of the shipment live only as long as this task.
+    Task runs in copy of request context, so thread is added to profiler of profiled request."""
+    try:
+        confirmation = idempotency_cache.get(shipment_id)
+        if confirmation is not None:
+            return confirmation
+        with profiler.attach(), tracing.trace(shipment_id, "addShipments"):
+            exporter_object = metrics.create_exporter(shipment_id)
+            carrier_name = type(exporter_object.carrier_exporter).__name__
+            with _carrier_lock:
+                limit = carrier_limits.setdefault(carrier_name, threading.Semaphore(carrier_limit))
+            with limit:
+                return idempotency_cache.run(shipment_id, lambda: metrics.send_shipment(exporter_object))
+    except Exception as error:
+        return error_to_confirmation(error)
+
+
+def add_shipments(shipment_ids: List[str], max_workers: int = BATCH_WORKERS, carrier_limit: int = BATCH_CARRIER_WORKERS) -> List[models.BatchShipmentResult]:
+    """Send many shipments to carriers. At most `max_workers` shipments are processed at once
+    and at most `carrier_limit` of them are sent to one carrier at once.
+    Failure of one shipment is reported in its result and does not stop the batch.
+
+    Args:
+        shipment_ids (List[str]): Row IDs from q_hl_TmsIntegration table
+        max_workers (int, optional): Concurrency limit of batch. Defaults to BATCH_WORKERS.
+        carrier_limit (int, optional): Concurrency limit per carrier. Defaults to BATCH_CARRIER_WORKERS.
+
+    Raises:
+        HTTPException: When batch has more than BATCH_MAX_SIZE unique row IDs
+
+    Returns:
+        List[models.BatchShipmentResult]: One result per unique shipment ID, in request order
+    """
+    shipment_ids = list(dict.fromkeys(shipment_ids))
+    if len(shipment_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail={"error": True, "error_description": f"Batch can contain at most {BATCH_MAX_SIZE} shipments, got {len(shipment_ids)}"})
+    carrier_limits: Dict[str, threading.Semaphore] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _send_shipment, shipment_id, carrier_limits, carrier_limit) for shipment_id in shipment_ids]
+        return [models.BatchShipmentResult(shipment_id=shipment_id, confirmation=future.result()) for shipment_id, future in zip(shipment_ids, futures)]
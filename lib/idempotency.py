@@ -0,0 +1,200 @@
+from concurrent.futures import Future, TimeoutError
+from typing import Callable, Dict, Optional
+from fastapi import HTTPException
+import os
+import sqlite3
+import threading
+import time
+import sentry_sdk
+import models
+
+
+IDEMPOTENCY_DB = os.environ.get("idempotency_db", "/home/ubuntu/logs/tms/idempotency.db")
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("idempotency_ttl_seconds", "86400"))
+# lease of in-flight row is renewed while shipment is sent, it only expires when owning worker died
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get("idempotency_lease_seconds", "30"))
+# must be lower than gunicorn timeout (120s)
+IDEMPOTENCY_MAX_WAIT_SECONDS = float(os.environ.get("idempotency_max_wait_seconds", "60"))
+
+
+class IdempotencyCache(object):
+    """Stores carrier confirmations per ShipmentId in SQLite so repeated
+    requests for this same shipment are not sent to carrier again.
+    Only successful confirmations are stored, failed shipments can be retried.
+    Concurrent requests for this same shipment wait for the first one:
+    inside worker through shared Future, between gunicorn workers through in-flight row with lease.
+    They wait at most `max_wait_seconds`, then HTTPException 409 is raised.
+    Cache is best-effort: when SQLite file can not be used shipment is sent without it.
+    """
+
+    def __init__(self, db_path: str = IDEMPOTENCY_DB, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, lease_seconds: float = IDEMPOTENCY_LEASE_SECONDS, poll_seconds: float = 0.5, max_wait_seconds: float = IDEMPOTENCY_MAX_WAIT_SECONDS) -> None:
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS shipments (
+                shipment_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                result TEXT,
+                expires_at REAL NOT NULL
+            )""")
+            self._initialized = True
+        return connection
+
+    def get(self, shipment_id: str) -> Optional[models.ShipmentConfirmation]:
+        """Read stored confirmation
+
+        Args:
+            shipment_id (str): Row ID from q_hl_TmsIntegration table
+
+        Returns:
+            Optional[models.ShipmentConfirmation]: Stored confirmation or None if shipment was not sent yet (or cache is unavailable)
+        """
+        try:
+            connection = self._connect()
+            try:
+                row = connection.execute(
+                    "SELECT result FROM shipments WHERE shipment_id = ? AND status = 'done' AND expires_at > ?",
+                    (shipment_id, time.time()),
+                ).fetchone()
+            finally:
+                connection.close()
+        except sqlite3.Error as error:
+            sentry_sdk.capture_exception(error)
+            return None
+        return models.ShipmentConfirmation.parse_raw(row['result']) if row else None
+
+    @staticmethod
+    def _in_progress(shipment_id: str) -> HTTPException:
+        confirmation = models.ShipmentConfirmation(status=409, result_code="InProgress", message=f"Shipment {shipment_id} is already being sent by other request")
+        return HTTPException(status_code=409, detail={"model": confirmation.dict()})
+
+    def _acquire(self, shipment_id: str) -> Optional[models.ShipmentConfirmation]:
+        """Wait until shipment is not in flight in other process, then mark it as in flight.
+        Returns stored confirmation instead if shipment was already sent.
+        Raises HTTPException 409 when other process does not finish in `max_wait_seconds`.
+        """
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            now = time.time()
+            connection = self._connect()
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute("SELECT status, result, expires_at FROM shipments WHERE shipment_id = ?", (shipment_id,)).fetchone()
+                if row is None or row['expires_at'] <= now:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO shipments (shipment_id, status, result, expires_at) VALUES (?, 'in_flight', NULL, ?)",
+                        (shipment_id, now + self.lease_seconds),
+                    )
+                    connection.execute("COMMIT")
+                    return None
+                connection.execute("COMMIT")
+            finally:
+                connection.close()
+            if row['status'] == 'done':
+                return models.ShipmentConfirmation.parse_raw(row['result'])
+            if time.monotonic() + self.poll_seconds > deadline:
+                raise self._in_progress(shipment_id)
+            time.sleep(self.poll_seconds)
+
+    def _renew_until(self, shipment_id: str, finished: threading.Event) -> None:
+        """Extend lease of in-flight row until shipment is sent"""
+        while not finished.wait(self.lease_seconds / 3):
+            try:
+                connection = self._connect()
+                try:
+                    connection.execute(
+                        "UPDATE shipments SET expires_at = ? WHERE shipment_id = ? AND status = 'in_flight'",
+                        (time.time() + self.lease_seconds, shipment_id),
+                    )
+                finally:
+                    connection.close()
+            except sqlite3.Error as error:
+                sentry_sdk.capture_exception(error)
+
+    def _release(self, shipment_id: str, confirmation: Optional[models.ShipmentConfirmation]) -> None:
+        now = time.time()
+        connection = self._connect()
+        try:
+            if confirmation is None:
+                connection.execute("DELETE FROM shipments WHERE shipment_id = ? AND status = 'in_flight'", (shipment_id,))
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO shipments (shipment_id, status, result, expires_at) VALUES (?, 'done', ?, ?)",
+                    (shipment_id, confirmation.json(), now + self.ttl_seconds),
+                )
+            connection.execute("DELETE FROM shipments WHERE expires_at <= ?", (now,))
+        finally:
+            connection.close()
+
+    def run(self, shipment_id: str, send_shipment: Callable[[], models.ShipmentConfirmation]) -> models.ShipmentConfirmation:
+        """Send shipment only once. Stored confirmation is returned for repeated requests,
+        concurrent requests wait for result of first one.
+
+        Args:
+            shipment_id (str): Row ID from q_hl_TmsIntegration table
+            send_shipment (Callable[[], models.ShipmentConfirmation]): Function sending shipment to carrier
+
+        Returns:
+            models.ShipmentConfirmation: Carrier confirmation
+        """
+        with self._lock:
+            future = self._in_flight.get(shipment_id)
+            owner = future is None
+            if owner:
+                future = self._in_flight[shipment_id] = Future()
+        if not owner:
+            try:
+                return future.result(timeout=self.max_wait_seconds)  # type: ignore
+            except TimeoutError:
+                raise self._in_progress(shipment_id)
+        try:
+            confirmation = self._send_once(shipment_id, send_shipment)
+            future.set_result(confirmation)  # type: ignore
+            return confirmation
+        except BaseException as error:
+            future.set_exception(error)  # type: ignore
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[shipment_id]
+
+    def _send_once(self, shipment_id: str, send_shipment: Callable[[], models.ShipmentConfirmation]) -> models.ShipmentConfirmation:
+        try:
+            confirmation = self._acquire(shipment_id)
+        except sqlite3.Error as error:
+            sentry_sdk.capture_exception(error)
+            return send_shipment()
+        if confirmation is not None:
+            return confirmation
+        finished = threading.Event()
+        threading.Thread(target=self._renew_until, args=(shipment_id, finished), name="tms-idempotency-lease", daemon=True).start()
+        try:
+            confirmation = send_shipment()
+        except BaseException:
+            finished.set()
+            self._safe_release(shipment_id, None)
+            raise
+        finished.set()
+        self._safe_release(shipment_id, confirmation)
+        return confirmation
+
+    def _safe_release(self, shipment_id: str, confirmation: Optional[models.ShipmentConfirmation]) -> None:
+        # shipment is already sent (or failed) at this point, error of cache must not change result
+        try:
+            self._release(shipment_id, confirmation)
+        except sqlite3.Error as error:
+            sentry_sdk.capture_exception(error)
+
+
+idempotency_cache = IdempotencyCache()
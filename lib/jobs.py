@@ -0,0 +1,269 @@
+from typing import List, Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import sentry_sdk
+from lib.batch import error_to_confirmation
+from lib.idempotency import idempotency_cache
+from lib import metrics, tracing
+import models
+
+
+JOBS_DB = os.environ.get("jobs_db", "/home/ubuntu/logs/tms/jobs.db")
+JOB_WORKERS = int(os.environ.get("job_workers", "0"))
+JOB_LEASE_SECONDS = float(os.environ.get("job_lease_seconds", "300"))
+JOB_POLL_SECONDS = float(os.environ.get("job_poll_seconds", "1"))
+JOB_MAX_POLL_SECONDS = float(os.environ.get("job_max_poll_seconds", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("job_max_attempts", "3"))
+
+
+class JobQueue(object):
+    """Durable queue of shipments stored in SQLite (WAL mode).
+    Rows are shared by all gunicorn workers, every claimed job gets a lease
+    (renewed while job is running) so jobs of a killed worker are picked up again
+    after the lease expires, at most `max_attempts` times.
+    Queue is disabled when `workers` is 0.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB, lease_seconds: float = JOB_LEASE_SECONDS, poll_seconds: float = JOB_POLL_SECONDS, workers: int = JOB_WORKERS, max_attempts: int = JOB_MAX_ATTEMPTS, max_poll_seconds: float = JOB_MAX_POLL_SECONDS) -> None:
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self._workers: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                shipment_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                lease_until REAL
+            )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            self._initialized = True
+        return connection
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def enqueue(self, shipment_id: str) -> models.JobStatus:
+        """Store shipment in queue
+
+        Args:
+            shipment_id (str): Row ID from q_hl_TmsIntegration table
+
+        Returns:
+            models.JobStatus: Status of newly created job
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute(
+                "INSERT INTO jobs (job_id, shipment_id, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, shipment_id, now, now),
+            )
+        finally:
+            connection.close()
+        self._wakeup.set()
+        return models.JobStatus(job_id=job_id, shipment_id=shipment_id, status='queued')
+
+    def get(self, job_id: str) -> Optional[models.JobStatus]:
+        """Read job status
+
+        Args:
+            job_id (str): ID returned by enqueue
+
+        Returns:
+            Optional[models.JobStatus]: Job status or None if job not exists
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            connection.close()
+        if row is None:
+            return None
+        result = models.ShipmentConfirmation(**json.loads(row['result'])) if row['result'] else None
+        return models.JobStatus(job_id=row['job_id'], shipment_id=row['shipment_id'], status=row['status'], attempts=row['attempts'], result=result)
+
+    def claim(self) -> Optional[models.JobStatus]:
+        """Take oldest queued job (or job with expired lease) and mark it as running.
+        Jobs with expired lease and `max_attempts` attempts are marked as failed.
+
+        Returns:
+            Optional[models.JobStatus]: Claimed job or None if queue is empty
+        """
+        claimable = """status = 'queued' OR (status = 'running' AND lease_until < ?)"""
+        now = time.time()
+        connection = self._connect()
+        try:
+            # plain read first, so idle workers do not take write lock
+            if connection.execute(f"SELECT 1 FROM jobs WHERE {claimable} LIMIT 1", (now,)).fetchone() is None:
+                return None
+            connection.execute("BEGIN IMMEDIATE")
+            exhausted = models.ShipmentConfirmation(status=500, result_code="Error", message=f"Job stopped after {self.max_attempts} attempts")
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', result = ?, lease_until = NULL, updated_at = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (exhausted.json(), now, now, self.max_attempts),
+            )
+            row = connection.execute(
+                f"SELECT job_id, shipment_id, attempts FROM jobs WHERE {claimable} ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE job_id = ?",
+                (now + self.lease_seconds, now, row['job_id']),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        return models.JobStatus(job_id=row['job_id'], shipment_id=row['shipment_id'], status='running', attempts=row['attempts'] + 1)
+
+    def renew(self, job_id: str) -> None:
+        """Extend lease of running job
+
+        Args:
+            job_id (str): ID of claimed job
+        """
+        connection = self._connect()
+        try:
+            connection.execute(
+                "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id),
+            )
+        finally:
+            connection.close()
+
+    def _renew_until(self, job_id: str, finished: threading.Event) -> None:
+        while not finished.wait(self.lease_seconds / 3):
+            try:
+                self.renew(job_id)
+            except sqlite3.Error as error:
+                sentry_sdk.capture_exception(error)
+
+    def complete(self, job_id: str, confirmation: models.ShipmentConfirmation) -> None:
+        """Save result of job. Confirmations with status 400 or higher mark job as failed
+
+        Args:
+            job_id (str): ID of claimed job
+            confirmation (models.ShipmentConfirmation): Result of shipment processing
+        """
+        status = 'failed' if confirmation.status >= 400 else 'done'
+        connection = self._connect()
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, lease_until = NULL, updated_at = ? WHERE job_id = ?",
+                (status, confirmation.json(), time.time(), job_id),
+            )
+        finally:
+            connection.close()
+
+    def requeue(self, job_id: str) -> None:
+        """Put running job back at the end of queue without counting its attempt,
+        used when shipment is still being sent by other request
+
+        Args:
+            job_id (str): ID of claimed job
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_until = NULL, created_at = ?, updated_at = ? WHERE job_id = ? AND status = 'running'",
+                (now, now, job_id),
+            )
+        finally:
+            connection.close()
+
+    def process_next(self) -> bool:
+        """Process one job from queue through Exporter.add_new_shipment
+
+        Returns:
+            bool: False if queue was empty
+        """
+        job = self.claim()
+        if job is None:
+            return False
+        finished = threading.Event()
+        threading.Thread(target=self._renew_until, args=(job.job_id, finished), name="tms-job-lease", daemon=True).start()
+        try:
+            with tracing.trace(job.shipment_id, "job"):
+                confirmation = idempotency_cache.run(job.shipment_id, lambda: metrics.send_new_shipment(job.shipment_id))
+        except Exception as error:
+            confirmation = error_to_confirmation(error)
+        finally:
+            finished.set()
+        if confirmation.result_code == "InProgress":
+            # other request for this shipment did not finish in time, its result is not known yet
+            self.requeue(job.job_id)
+        else:
+            self.complete(job.job_id, confirmation)
+        return True
+
+    def _run_worker(self) -> None:
+        poll_seconds = self.poll_seconds
+        while not self._stop.is_set():
+            try:
+                processed = self.process_next()
+                poll_seconds = self.poll_seconds
+                if processed:
+                    continue
+            except sqlite3.Error as error:
+                # report only first error of series and back off, database may be unavailable for long time
+                if poll_seconds == self.poll_seconds:
+                    sentry_sdk.capture_exception(error)
+                poll_seconds = min(poll_seconds * 2, self.max_poll_seconds)
+            self._wakeup.wait(poll_seconds)
+            self._wakeup.clear()
+
+    def start(self, workers: Optional[int] = None) -> None:
+        """Start background threads draining the queue. Nothing is started when queue is disabled.
+
+        Args:
+            workers (Optional[int], optional): Number of threads. Defaults to `workers` given in constructor.
+        """
+        self._stop.clear()
+        for number in range(self.workers if workers is None else workers):
+            worker = threading.Thread(target=self._run_worker, name=f"tms-job-worker-{number}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float = 5) -> None:
+        """Stop background threads, running jobs are finished first
+
+        Args:
+            timeout (float, optional): Seconds to wait for every thread. Defaults to 5.
+        """
+        self._stop.set()
+        self._wakeup.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+
+job_queue = JobQueue()
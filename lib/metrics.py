@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+from typing import Any, Iterator, Tuple, Union
+from fastapi import HTTPException
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+import os
+import time
+from lib import tracing
+from lib.exporter import Exporter
+import models
+
+
+STAGE_DURATION = Histogram(
+    "tms_stage_duration_seconds",
+    "Duration of shipment processing stages",
+    ["stage"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+SHIPMENTS = Counter(
+    "tms_shipments_total",
+    "Shipments sent to carriers",
+    ["carrier", "result_code"],
+)
+
+
+@contextmanager
+def timed(stage: str, **attributes: Any) -> Iterator[Union[tracing.Span, tracing._NoopSpan]]:
+    """Measure duration of code block in tms_stage_duration_seconds histogram.
+    In traced request it is also recorded as span.
+
+    Args:
+        stage (str): Name of stage, e.g. name of Jeeves query or carrier operation
+        **attributes: Extra information stored with span
+    """
+    started = time.perf_counter()
+    try:
+        with tracing.span(stage, **attributes) as current:
+            yield current
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - started)
+
+
+def _error_result_code(error: Exception) -> str:
+    if not isinstance(error, HTTPException):
+        return "Exception"
+    detail = error.detail
+    if isinstance(detail, dict) and 'model' in detail:
+        return detail['model'].get('result_code') or str(detail['model'].get('status'))
+    return str(error.status_code)
+
+
+def send_shipment(exporter_object) -> models.ShipmentConfirmation:
+    """Send shipment with Exporter.add_new_shipment, measure it and count result per carrier
+
+    Args:
+        exporter_object (Exporter): Exporter created for shipment
+
+    Returns:
+        models.ShipmentConfirmation: Carrier confirmation
+    """
+    carrier = type(exporter_object.carrier_exporter).__name__
+    with timed("add_new_shipment", carrier=carrier) as current:
+        try:
+            confirmation = exporter_object.add_new_shipment()
+        except Exception as error:
+            SHIPMENTS.labels(carrier, _error_result_code(error)).inc()
+            raise
+        result_code = confirmation.result_code or str(confirmation.status)
+        current.set("result_code", result_code)
+    SHIPMENTS.labels(carrier, result_code).inc()
+    return confirmation
+
+
+def create_exporter(shipment_id: str) -> Exporter:
+    """Create Exporter for shipment, measured as exporter_init stage
+
+    Args:
+        shipment_id (str): Row ID from q_hl_TmsIntegration table
+
+    Returns:
+        Exporter: Exporter created for shipment
+    """
+    with timed("exporter_init"):
+        return Exporter(shipment_id)
+
+
+def send_new_shipment(shipment_id: str) -> models.ShipmentConfirmation:
+    """Create Exporter and send shipment with it. Used by all endpoints and job workers sending single shipment
+
+    Args:
+        shipment_id (str): Row ID from q_hl_TmsIntegration table
+
+    Returns:
+        models.ShipmentConfirmation: Carrier confirmation
+    """
+    return send_shipment(create_exporter(shipment_id))
+
+
+def render() -> Tuple[bytes, str]:
+    """Render metrics in Prometheus text format. When PROMETHEUS_MULTIPROC_DIR is set
+    values from all gunicorn workers are aggregated.
+
+    Returns:
+        Tuple[bytes, str]: Metrics and content type
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
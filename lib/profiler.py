@@ -0,0 +1,144 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Set
+from urllib.parse import parse_qs
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+
+
+PROFILE_TOKEN = os.environ.get("profile_token", "")
+PROFILE_DIR = os.environ.get("profile_dir", "/home/ubuntu/logs/tms/profiles")
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("profile_interval_ms", "5")) / 1000
+PROFILE_MIN_SPACING_SECONDS = float(os.environ.get("profile_min_spacing_seconds", "60"))
+PROFILE_HEADER = b"x-tms-profile"
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def _frame_name(frame) -> str:
+    filename = frame.f_code.co_filename
+    if filename.startswith(ROOT_DIR):
+        filename = os.path.relpath(filename, ROOT_DIR)
+    return f"{frame.f_code.co_name} ({filename}:{frame.f_code.co_firstlineno})"
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    """Samples stacks of attached threads every `interval` seconds.
+    Result is in folded format (one "frame;frame;frame count" line per stack)
+    used by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL_SECONDS) -> None:
+        super().__init__(name="tms-profiler", daemon=True)
+        self.interval = interval
+        self.thread_ids: Set[int] = set()
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[_fold(frame)] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+_current_sampler: ContextVar[Optional[Sampler]] = ContextVar("tms_current_sampler", default=None)
+
+
+@contextmanager
+def attach() -> Iterator[None]:
+    """Add current thread to profiler of this request. Does nothing when request is not profiled."""
+    sampler = _current_sampler.get()
+    if sampler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    sampler.thread_ids.add(thread_id)
+    try:
+        yield
+    finally:
+        sampler.thread_ids.discard(thread_id)
+
+
+class ProfilerMiddleware(object):
+    """Profiles single request when it has `x-tms-profile: <profile_token>` header
+    or `profile=<profile_token>` query parameter. Folded stacks are saved in PROFILE_DIR
+    and file name is returned in `x-tms-profile-file` response header.
+    Every worker profiles at most one request per `min_spacing` seconds.
+    """
+
+    def __init__(self, app, token: str = PROFILE_TOKEN, directory: str = PROFILE_DIR, interval: float = PROFILE_INTERVAL_SECONDS, min_spacing: float = PROFILE_MIN_SPACING_SECONDS) -> None:
+        self.app = app
+        self.token = token
+        self.directory = directory
+        self.interval = interval
+        self.min_spacing = min_spacing
+        self._lock = threading.Lock()
+        self._last_started = float("-inf")
+
+    def _is_authorized(self, scope) -> bool:
+        if not self.token:
+            return False
+        values = [value for key, value in scope.get("headers", []) if key == PROFILE_HEADER]
+        # query values are decoded as latin-1, so they are turned back into raw bytes like header values
+        values += [value.encode("latin-1") for value in parse_qs(scope.get("query_string", b"").decode("latin-1"), encoding="latin-1").get("profile", [])]
+        return any(hmac.compare_digest(value, self.token.encode()) for value in values)
+
+    def _acquire(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            return False
+        now = time.monotonic()
+        if now - self._last_started < self.min_spacing:
+            self._lock.release()
+            return False
+        self._last_started = now
+        return True
+
+    def _file_name(self, path: str) -> str:
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", path.strip("/")) or "root"
+        return os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{name}.folded")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_authorized(scope) or not self._acquire():
+            await self.app(scope, receive, send)
+            return
+        sampler = Sampler(self.interval)
+        file_name = self._file_name(scope["path"])
+
+        async def send_with_profile_header(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-tms-profile-file", file_name.encode("latin-1"))]
+            await send(message)
+
+        token = _current_sampler.set(sampler)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_header)
+        finally:
+            sampler.stop()
+            _current_sampler.reset(token)
+            self._lock.release()
+            os.makedirs(self.directory, exist_ok=True)
+            with open(file_name, "w") as profile_file:
+                profile_file.write(sampler.folded())
@@ -0,0 +1,147 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Union
+import os
+import random
+import threading
+import time
+import uuid
+import sentry_sdk
+import models
+
+
+TRACE_SAMPLE_RATE = float(os.environ.get("trace_sample_rate", "0"))
+TRACE_BUFFER_SIZE = int(os.environ.get("trace_buffer_size", "200"))
+TRACE_TO_SENTRY = os.environ.get("trace_to_sentry", "false") == "true"
+# sentry_sdk drops all transactions when traces_sample_rate is None, with 0 only transactions
+# started with sampled=True (traces sampled by TRACE_SAMPLE_RATE) are sent
+SENTRY_TRACES_SAMPLE_RATE: Optional[float] = 0 if TRACE_TO_SENTRY else None
+
+
+class Span(object):
+    """Timed operation of traced request. Spans opened inside this one are stored as children."""
+    __slots__ = ("name", "attributes", "start", "duration", "error", "children", "_started", "_sentry_span")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], sentry_span=None) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.children: List[Span] = []
+        self._started = time.perf_counter()
+        self._sentry_span = sentry_span
+
+    def set(self, key: str, value: Any) -> None:
+        """Add attribute to span, e.g. row count of SQL query
+
+        Args:
+            key (str): Attribute name
+            value (Any): Attribute value
+        """
+        self.attributes[key] = value
+
+    def _finish(self) -> None:
+        self.duration = time.perf_counter() - self._started
+        if self._sentry_span is not None:
+            for key, value in self.attributes.items():
+                self._sentry_span.set_data(key, value)
+            self._sentry_span.finish()
+
+    def to_model(self) -> models.SpanData:
+        return models.SpanData(
+            name=self.name,
+            start=self.start,
+            duration_ms=round(self.duration * 1000, 3),
+            attributes=self.attributes,
+            error=self.error,
+            children=[child.to_model() for child in self.children],
+        )
+
+
+class _NoopSpan(object):
+    """Returned when request is not traced, so instrumented code does not need to check it"""
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: ContextVar[Optional[Span]] = ContextVar("tms_current_span", default=None)
+_traces: Deque[models.Trace] = deque(maxlen=TRACE_BUFFER_SIZE)
+_traces_lock = threading.Lock()
+
+
+@contextmanager
+def _run_span(current: Span) -> Iterator[Span]:
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as error:
+        current.error = repr(error)
+        raise
+    finally:
+        _current_span.reset(token)
+        current._finish()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Union[Span, _NoopSpan]]:
+    """Measure operation inside traced request. Does nothing when request is not traced.
+
+    Args:
+        name (str): Operation name
+        **attributes: Extra information stored with span
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    sentry_span = parent._sentry_span.start_child(op=name) if parent._sentry_span is not None else None
+    current = Span(name, attributes, sentry_span)
+    parent.children.append(current)
+    with _run_span(current):
+        yield current
+
+
+@contextmanager
+def trace(shipment_id: str, name: str, sample_rate: Optional[float] = None) -> Iterator[Union[Span, _NoopSpan]]:
+    """Start trace of shipment request. Finished trace is stored in ring buffer.
+    Inside already traced request it only opens new span.
+
+    Args:
+        shipment_id (str): Row ID from q_hl_TmsIntegration table
+        name (str): Name of top level operation
+        sample_rate (Optional[float], optional): Part of requests to trace. Defaults to TRACE_SAMPLE_RATE.
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if _current_span.get() is not None or rate <= 0 or random.random() >= rate:
+        with span(name, shipment_id=shipment_id) as current:
+            yield current
+        return
+    sentry_span = None
+    if TRACE_TO_SENTRY:
+        sentry_span = sentry_sdk.start_transaction(op="shipment", name=name, sampled=True)
+        sentry_span.set_tag("shipment_id", shipment_id)
+    root = Span(name, {"shipment_id": shipment_id}, sentry_span)
+    try:
+        with _run_span(root):
+            yield root
+    finally:
+        with _traces_lock:
+            _traces.append(models.Trace(trace_id=uuid.uuid4().hex, shipment_id=shipment_id, root=root.to_model()))
+
+
+def find_traces(shipment_id: Optional[str] = None) -> List[models.Trace]:
+    """Read traces stored in this worker, newest first
+
+    Args:
+        shipment_id (Optional[str], optional): Return only traces of this shipment. Defaults to None.
+
+    Returns:
+        List[models.Trace]: Stored traces
+    """
+    with _traces_lock:
+        traces = list(_traces)
+    return [stored for stored in reversed(traces) if shipment_id is None or stored.shipment_id == shipment_id]
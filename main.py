@@ -1,9 +1,16 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, Response
+from typing import List, Optional
 import os
 from sentry_asgi import SentryMiddleware
 import sentry_sdk
 import socket
-from lib.exporter import Exporter
+from lib.batch import add_shipments
+from lib.jobs import job_queue
+from lib.idempotency import idempotency_cache
+from lib import metrics, tracing
+from lib.profiler import ProfilerMiddleware, attach as attach_profiler
+import models
 
 
 # Main config
@@ -11,7 +18,7 @@ if socket.gethostname() == 'bma-app-101':  # pragma: no cover
     environment = 'Prod'
 else:  # pragma: no cover
     environment = 'DEV'
-sentry_sdk.init(dsn="https://a1f1ef7bb02a450692ec3f7fbd328978@o229295.ingest.sentry.io/6261843", environment=environment)
+sentry_sdk.init(dsn="https://a1f1ef7bb02a450692ec3f7fbd328978@o229295.ingest.sentry.io/6261843", environment=environment, traces_sample_rate=tracing.SENTRY_TRACES_SAMPLE_RATE)
 
 app = FastAPI(
     title="Transportation management system API",
@@ -19,16 +26,53 @@ app = FastAPI(
     version="1.0.0",
 )
 
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    job_queue.stop()
+
 @app.get("/get_order_data")
 def get_order_data(shipment_id):
-    exporter_object = Exporter(shipment_id)
-    return exporter_object.get_shipment_data()
+    with attach_profiler(), tracing.trace(shipment_id, "get_order_data"):
+        exporter_object = metrics.create_exporter(shipment_id)
+        with metrics.timed("get_shipment_data"):
+            return exporter_object.get_shipment_data()
 
 @app.post("/addShipment")
-def addShipment(shipment_id):
-    exporter_object = Exporter(shipment_id)
-    return exporter_object.add_new_shipment()
+def addShipment(shipment_id, async_mode: bool = False):
+    if async_mode:
+        if not job_queue.enabled:
+            raise HTTPException(status_code=400, detail={"error": True, "error_description": "Async mode disabled, set job_workers to enable it"})
+        return JSONResponse(status_code=202, content=job_queue.enqueue(shipment_id).dict())
+    with attach_profiler(), tracing.trace(shipment_id, "addShipment"):
+        return idempotency_cache.run(shipment_id, lambda: metrics.send_new_shipment(shipment_id))
+
+@app.post("/addShipments", response_model=List[models.BatchShipmentResult])
+def addShipments(shipment_ids: List[str]):
+    with attach_profiler():
+        return add_shipments(shipment_ids)
+
+@app.get("/jobs/{job_id}", response_model=models.JobStatus)
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": True, "error_description": f"Job {job_id} not found"})
+    return job
+
+@app.get("/debug/traces", response_model=List[models.Trace])
+def get_traces(shipment_id: Optional[str] = None):
+    return tracing.find_traces(shipment_id)
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
     
+# Profiler config
+app = ProfilerMiddleware(app)
 # Sentry config
 app = SentryMiddleware(app)
 # Uvicorn config
@@ -1,6 +1,8 @@
 from .jeeves import OrderData, CompanyInfo, DeliveryInfo, Package, ExporterResults
-from .shipment import ShipmentConfirmation, ShipmentMeta
+from .shipment import ShipmentConfirmation, ShipmentMeta, BatchShipmentResult
 from .exporter import CarrierResults
 from .Transmission import shipment
 from .Transmission_jeeves import TransmissionShipment, TransmissionRowData, TransmissionShipmentData
 from .gls import GlsShipment, srv_bool, parcel, items
+from .job import JobStatus
+from .trace import SpanData, Trace
@@ -0,0 +1,20 @@
+from typing import Optional
+from pydantic import BaseModel
+from .shipment import ShipmentConfirmation
+
+
+class JobStatus(BaseModel):
+    """Model for storing status of shipment processed in background
+
+    Keys:
+        job_id (str): ID of job in local queue
+        shipment_id (str): Row ID from q_hl_TmsIntegration table
+        status (str): One of queued, running, done, failed
+        attempts (int): How many times job was taken by worker
+        result (ShipmentConfirmation): Carrier confirmation, filled when job is done or failed
+    """
+    job_id: str
+    shipment_id: str
+    status: str
+    attempts: int = 0
+    result: Optional[ShipmentConfirmation]
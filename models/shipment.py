@@ -12,4 +12,14 @@ class ShipmentConfirmation(BaseModel):
     result_code: str = ""
     message: str = ""
     data: Optional[ShipmentData]
-    meta: Optional[ShipmentMeta]
\ No newline at end of file
+    meta: Optional[ShipmentMeta]
+
+class BatchShipmentResult(BaseModel):
+    """Model for storing result of one shipment from batch request
+
+    Keys:
+        shipment_id (str): Row ID from q_hl_TmsIntegration table
+        confirmation (ShipmentConfirmation): Carrier confirmation or error description
+    """
+    shipment_id: str
+    confirmation: ShipmentConfirmation
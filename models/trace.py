@@ -0,0 +1,35 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+
+class SpanData(BaseModel):
+    """Model for storing one timed operation of traced request
+
+    Keys:
+        name (str): Operation name, e.g. exporter_init or add_new_shipment
+        start (float): Unix timestamp of operation start
+        duration_ms (float): Duration of operation in milliseconds
+        attributes (Dict): Extra information, e.g. carrier name or row count
+        error (str): Representation of exception raised by operation
+        children (List[SpanData]): Operations called inside this one
+    """
+    name: str
+    start: float
+    duration_ms: float
+    attributes: Dict = {}
+    error: Optional[str]
+    children: List['SpanData'] = []
+
+SpanData.update_forward_refs()
+
+class Trace(BaseModel):
+    """Model for storing call tree of one shipment request
+
+    Keys:
+        trace_id (str): Unique ID of trace
+        shipment_id (str): Row ID from q_hl_TmsIntegration table
+        root (SpanData): Top level operation
+    """
+    trace_id: str
+    shipment_id: str
+    root: SpanData
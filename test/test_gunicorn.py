@@ -1,3 +1,4 @@
+from unittest.mock import patch, MagicMock
 import gunicorn
 
 def test_config():
@@ -7,3 +8,30 @@ def test_config():
     assert gunicorn.bind == "0.0.0.0:8400"
     assert gunicorn.worker_class == "uvicorn.workers.UvicornWorker"
     assert gunicorn.timeout == 120
+    assert gunicorn.preload_app == False
+
+def test_on_starting(monkeypatch, tmp_path):
+    directory = tmp_path / "prometheus"
+    directory.mkdir()
+    (directory / "counter_1.db").write_text("old metrics")
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(directory))
+    gunicorn.on_starting(MagicMock())
+    assert list(directory.iterdir()) == []
+
+def test_on_starting_no_multiproc_dir(monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    gunicorn.on_starting(MagicMock())
+
+@patch("prometheus_client.multiprocess.mark_process_dead")
+def test_child_exit(mocked_mark_process_dead: MagicMock, monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    worker = MagicMock()
+    worker.pid = 1234
+    gunicorn.child_exit(MagicMock(), worker)
+    mocked_mark_process_dead.assert_called_with(1234)
+
+@patch("prometheus_client.multiprocess.mark_process_dead")
+def test_child_exit_no_multiproc_dir(mocked_mark_process_dead: MagicMock, monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    gunicorn.child_exit(MagicMock(), MagicMock())
+    mocked_mark_process_dead.assert_not_called()
@@ -0,0 +1,144 @@
+import pytest
+import threading
+import time
+from unittest.mock import patch, MagicMock
+from fastapi import HTTPException
+from lib.batch import add_shipments, error_to_confirmation
+from lib import profiler, tracing
+import models
+
+
+class GLS(object):
+    pass
+
+class TransMission(object):
+    pass
+
+@pytest.fixture(autouse=True)
+def mocked_idempotency_cache():
+    with patch("lib.batch.idempotency_cache") as mocked_idempotency_cache:
+        mocked_idempotency_cache.get.return_value = None
+        mocked_idempotency_cache.run.side_effect = lambda shipment_id, send_shipment: send_shipment()
+        yield mocked_idempotency_cache
+
+def mocked_exporter(shipment_id: str):
+    exporter_object = MagicMock()
+    if shipment_id == 'not found':
+        raise HTTPException(status_code=404, detail={"error": True, "error_description": "Mocked not found"})
+    exporter_object.carrier_exporter = GLS() if shipment_id.startswith('gls') else TransMission()
+    if shipment_id == 'gls-error':
+        exporter_object.add_new_shipment.side_effect = HTTPException(status_code=400, detail={"model": {"status": 418, "result_code": "Mocked Error", "message": "Mocked error message"}})
+    elif shipment_id == 'tms-crash':
+        exporter_object.add_new_shipment.side_effect = ValueError("Mocked crash")
+    else:
+        exporter_object.add_new_shipment.return_value = models.ShipmentConfirmation(status=201, result_code="OK", message=shipment_id)
+    return exporter_object
+
+def test_error_to_confirmation_model():
+    error = HTTPException(status_code=400, detail={"model": {"status": 418, "result_code": "Mocked Error", "message": "Mocked error message"}})
+    assert error_to_confirmation(error) == models.ShipmentConfirmation(status=418, result_code="Mocked Error", message="Mocked error message")
+
+def test_error_to_confirmation_error_description():
+    error = HTTPException(status_code=409, detail={"error": True, "error_description": {"Mocked error key": "Mocked error value"}})
+    assert error_to_confirmation(error) == models.ShipmentConfirmation(status=409, result_code="Error", message="{'Mocked error key': 'Mocked error value'}")
+
+def test_error_to_confirmation_string_detail():
+    error = HTTPException(status_code=404, detail="Mocked detail")
+    assert error_to_confirmation(error) == models.ShipmentConfirmation(status=404, result_code="Error", message="Mocked detail")
+
+@patch("lib.batch.sentry_sdk.capture_exception")
+def test_error_to_confirmation_unexpected(mocked_capture_exception: MagicMock):
+    error = ValueError("Mocked crash")
+    assert error_to_confirmation(error) == models.ShipmentConfirmation(status=500, result_code="Error", message="Mocked crash")
+    mocked_capture_exception.assert_called_with(error)
+
+@patch("lib.batch.sentry_sdk.capture_exception")
+@patch("lib.metrics.Exporter")
+def test_add_shipments(mocked_Exporter: MagicMock, mocked_capture_exception: MagicMock):
+    mocked_Exporter.side_effect = mocked_exporter
+    results = add_shipments(['gls-1', 'tms-1', 'not found', 'gls-error', 'tms-crash', 'gls-1'], max_workers=2)
+    assert [result.shipment_id for result in results] == ['gls-1', 'tms-1', 'not found', 'gls-error', 'tms-crash']
+    assert [result.confirmation.status for result in results] == [201, 201, 404, 418, 500]
+    assert results[0].confirmation.message == 'gls-1'
+    assert results[2].confirmation.message == 'Mocked not found'
+    assert results[4].confirmation.message == 'Mocked crash'
+    assert mocked_Exporter.call_count == 5
+
+@patch("lib.metrics.Exporter")
+def test_add_shipments_empty(mocked_Exporter: MagicMock):
+    assert add_shipments([]) == []
+    mocked_Exporter.assert_not_called()
+
+@patch("lib.metrics.Exporter")
+def test_add_shipments_already_sent(mocked_Exporter: MagicMock, mocked_idempotency_cache: MagicMock):
+    mocked_idempotency_cache.get.return_value = models.ShipmentConfirmation(status=201, result_code="OK", message="Cached")
+    results = add_shipments(['gls-1'])
+    assert results[0].confirmation.message == 'Cached'
+    mocked_Exporter.assert_not_called()
+
+@patch("lib.batch.BATCH_MAX_SIZE", 2)
+@patch("lib.metrics.Exporter")
+def test_add_shipments_too_big(mocked_Exporter: MagicMock):
+    with pytest.raises(HTTPException) as error:
+        add_shipments(['1', '2', '3', '1'])
+    assert error.value.status_code == 413
+    mocked_Exporter.assert_not_called()
+
+@patch("lib.metrics.Exporter")
+def test_add_shipments_limits(mocked_Exporter: MagicMock):
+    lock = threading.Lock()
+    alive = {"exporters": 0, "max_exporters": 0, "sending": {}, "max_sending": {}}
+    def exporter(shipment_id: str):
+        with lock:
+            alive["exporters"] += 1
+            alive["max_exporters"] = max(alive["max_exporters"], alive["exporters"])
+        exporter_object = MagicMock()
+        carrier = GLS() if shipment_id.startswith('gls') else TransMission()
+        exporter_object.carrier_exporter = carrier
+        def add_new_shipment():
+            name = type(carrier).__name__
+            with lock:
+                alive["sending"][name] = alive["sending"].get(name, 0) + 1
+                alive["max_sending"][name] = max(alive["max_sending"].get(name, 0), alive["sending"][name])
+            time.sleep(0.01)
+            with lock:
+                alive["sending"][name] -= 1
+                alive["exporters"] -= 1
+            return models.ShipmentConfirmation(status=201)
+        exporter_object.add_new_shipment.side_effect = add_new_shipment
+        return exporter_object
+    mocked_Exporter.side_effect = exporter
+    shipment_ids = [f"gls-{number}" for number in range(10)] + [f"tms-{number}" for number in range(10)]
+    results = add_shipments(shipment_ids, max_workers=4, carrier_limit=2)
+    assert [result.confirmation.status for result in results] == [201] * 20
+    assert alive["max_exporters"] <= 4
+    assert set(alive["max_sending"]) == {"GLS", "TransMission"}
+    assert max(alive["max_sending"].values()) <= 2
+
+@patch("lib.tracing.TRACE_SAMPLE_RATE", 1)
+@patch("lib.metrics.Exporter")
+def test_add_shipments_one_trace_per_shipment(mocked_Exporter: MagicMock):
+    tracing._traces.clear()
+    mocked_Exporter.side_effect = mocked_exporter
+    add_shipments(['gls-1'])
+    traces = tracing.find_traces('gls-1')
+    assert len(traces) == 1
+    assert traces[0].root.name == "addShipments"
+    assert [child.name for child in traces[0].root.children] == ["exporter_init", "add_new_shipment"]
+
+@patch("lib.metrics.Exporter")
+def test_add_shipments_profiled(mocked_Exporter: MagicMock):
+    def send_slowly():
+        time.sleep(0.05)
+        return models.ShipmentConfirmation(status=201)
+    mocked_Exporter.return_value.add_new_shipment.side_effect = send_slowly
+    sampler = profiler.Sampler(interval=0.001)
+    sampler.start()
+    token = profiler._current_sampler.set(sampler)
+    try:
+        add_shipments(['1', '2'], max_workers=2)
+    finally:
+        profiler._current_sampler.reset(token)
+        sampler.stop()
+    assert sampler.thread_ids == set()
+    assert "_send_shipment (lib/batch.py:" in sampler.folded()
@@ -0,0 +1,164 @@
+import pytest
+import sqlite3
+import threading
+from unittest.mock import patch, MagicMock
+from fastapi import HTTPException
+from lib.idempotency import IdempotencyCache
+import models
+
+
+confirmation = models.ShipmentConfirmation(status=201, result_code="OK", message="Mocked message")
+
+@pytest.fixture
+def cache(tmp_path):
+    return IdempotencyCache(db_path=str(tmp_path / "idempotency.db"), ttl_seconds=60, lease_seconds=30, poll_seconds=0.01)
+
+def test_IdempotencyCache_run(cache: IdempotencyCache):
+    send_shipment = MagicMock(return_value=confirmation)
+    assert cache.run('1', send_shipment) == confirmation
+    assert cache.run('1', send_shipment) == confirmation
+    assert send_shipment.call_count == 1
+    assert cache.get('1') == confirmation
+
+def test_IdempotencyCache_get_not_sent(cache: IdempotencyCache):
+    assert cache.get('1') is None
+
+def test_IdempotencyCache_run_error_not_stored(cache: IdempotencyCache):
+    send_shipment = MagicMock(side_effect=[HTTPException(status_code=400, detail="Mocked error"), confirmation])
+    with pytest.raises(HTTPException):
+        cache.run('1', send_shipment)
+    assert cache.get('1') is None
+    assert cache.run('1', send_shipment) == confirmation
+
+def test_IdempotencyCache_run_expired(cache: IdempotencyCache):
+    send_shipment = MagicMock(return_value=confirmation)
+    cache.run('1', send_shipment)
+    with patch("lib.idempotency.time.time") as mocked_time:
+        mocked_time.return_value = 10 ** 12
+        assert cache.get('1') is None
+        cache.run('1', send_shipment)
+    assert send_shipment.call_count == 2
+
+def test_IdempotencyCache_run_concurrent_in_worker(cache: IdempotencyCache):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def send_shipment():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return confirmation
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.run('1', send_shipment))) for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [confirmation] * 3
+    assert len(calls) == 1
+
+def test_IdempotencyCache_run_concurrent_in_worker_error(cache: IdempotencyCache):
+    started = threading.Event()
+    release = threading.Event()
+    def send_shipment():
+        started.set()
+        release.wait(5)
+        raise HTTPException(status_code=400, detail="Mocked error")
+    errors = []
+    def run():
+        try:
+            cache.run('1', send_shipment)
+        except HTTPException as error:
+            errors.append(error.status_code)
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    threads[0].start()
+    started.wait(5)
+    threads[1].start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert errors == [400, 400]
+
+def test_IdempotencyCache_run_in_flight_other_process(cache: IdempotencyCache, tmp_path):
+    other_worker = IdempotencyCache(db_path=cache.db_path)
+    assert other_worker._acquire('1') is None
+    threading.Timer(0.05, other_worker._release, args=('1', confirmation)).start()
+    send_shipment = MagicMock()
+    assert cache.run('1', send_shipment) == confirmation
+    send_shipment.assert_not_called()
+
+def test_IdempotencyCache_run_in_flight_other_process_failed(cache: IdempotencyCache, tmp_path):
+    other_worker = IdempotencyCache(db_path=cache.db_path)
+    other_worker._acquire('1')
+    threading.Timer(0.05, other_worker._release, args=('1', None)).start()
+    send_shipment = MagicMock(return_value=confirmation)
+    assert cache.run('1', send_shipment) == confirmation
+    send_shipment.assert_called_once()
+
+def test_IdempotencyCache_run_in_flight_other_process_timeout(cache: IdempotencyCache):
+    cache.max_wait_seconds = 0.05
+    other_worker = IdempotencyCache(db_path=cache.db_path)
+    other_worker._acquire('1')
+    send_shipment = MagicMock()
+    with pytest.raises(HTTPException) as error:
+        cache.run('1', send_shipment)
+    assert error.value.status_code == 409
+    assert error.value.detail['model']['result_code'] == "InProgress"
+    send_shipment.assert_not_called()
+
+def test_IdempotencyCache_run_concurrent_in_worker_timeout(cache: IdempotencyCache):
+    cache.max_wait_seconds = 0.05
+    started = threading.Event()
+    release = threading.Event()
+    def send_shipment():
+        started.set()
+        release.wait(5)
+        return confirmation
+    owner = threading.Thread(target=cache.run, args=('1', send_shipment))
+    owner.start()
+    started.wait(5)
+    with pytest.raises(HTTPException) as error:
+        cache.run('1', send_shipment)
+    release.set()
+    owner.join(5)
+    assert error.value.status_code == 409
+
+def test_IdempotencyCache_run_renews_lease(cache: IdempotencyCache):
+    cache.lease_seconds = 0.06
+    other_worker = IdempotencyCache(db_path=cache.db_path, poll_seconds=0.01, max_wait_seconds=0.05)
+    def send_shipment():
+        threading.Event().wait(0.2)
+        with pytest.raises(HTTPException):
+            other_worker._acquire('1')
+        return confirmation
+    assert cache.run('1', send_shipment) == confirmation
+
+@patch("lib.idempotency.sentry_sdk")
+def test_IdempotencyCache_run_unavailable_db(mocked_sentry, tmp_path):
+    cache = IdempotencyCache(db_path=str(tmp_path / "missing" / "idempotency.db"))
+    send_shipment = MagicMock(return_value=confirmation)
+    assert cache.get('1') is None
+    assert cache.run('1', send_shipment) == confirmation
+    send_shipment.assert_called_once()
+    assert mocked_sentry.capture_exception.call_count == 2
+
+@patch("lib.idempotency.sentry_sdk")
+def test_IdempotencyCache_run_release_error(mocked_sentry, cache: IdempotencyCache):
+    send_shipment = MagicMock(return_value=confirmation)
+    with patch.object(cache, "_release", side_effect=sqlite3.OperationalError("disk I/O error")):
+        assert cache.run('1', send_shipment) == confirmation
+    mocked_sentry.capture_exception.assert_called_once()
+
+@patch("lib.idempotency.sentry_sdk")
+def test_IdempotencyCache_renew_until_error(mocked_sentry, cache: IdempotencyCache):
+    cache.lease_seconds = 0.03
+    finished = threading.Event()
+    def connect():
+        finished.set()
+        raise sqlite3.OperationalError("database is locked")
+    with patch.object(cache, "_connect", side_effect=connect):
+        cache._renew_until('1', finished)
+    mocked_sentry.capture_exception.assert_called_once()
@@ -0,0 +1,191 @@
+import pytest
+import sqlite3
+import threading
+import time
+from unittest.mock import patch, MagicMock
+from fastapi import HTTPException
+from lib.jobs import JobQueue
+import models
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(db_path=str(tmp_path / "jobs.db"), lease_seconds=60, poll_seconds=0.01)
+
+@pytest.fixture(autouse=True)
+def mocked_idempotency_cache():
+    with patch("lib.jobs.idempotency_cache") as mocked_idempotency_cache:
+        mocked_idempotency_cache.run.side_effect = lambda shipment_id, send_shipment: send_shipment()
+        yield mocked_idempotency_cache
+
+def test_JobQueue_enqueue(queue: JobQueue):
+    job = queue.enqueue('123456')
+    assert job.status == 'queued'
+    assert queue.get(job.job_id) == models.JobStatus(job_id=job.job_id, shipment_id='123456', status='queued')
+
+def test_JobQueue_get_not_existing(queue: JobQueue):
+    assert queue.get('Not existing job') is None
+
+def test_JobQueue_claim(queue: JobQueue):
+    first_job = queue.enqueue('1')
+    queue.enqueue('2')
+    claimed = queue.claim()
+    assert claimed == models.JobStatus(job_id=first_job.job_id, shipment_id='1', status='running', attempts=1)
+    assert queue.claim().shipment_id == '2'  # type: ignore
+    assert queue.claim() is None
+
+def test_JobQueue_claim_expired_lease(queue: JobQueue):
+    job = queue.enqueue('1')
+    queue.claim()
+    with patch("lib.jobs.time.time") as mocked_time:
+        mocked_time.return_value = 10 ** 12
+        claimed = queue.claim()
+    assert claimed.job_id == job.job_id  # type: ignore
+    assert claimed.attempts == 2  # type: ignore
+
+def test_JobQueue_claim_error(queue: JobQueue):
+    queue.enqueue('1')
+    queue.lease_seconds = None  # type: ignore
+    with pytest.raises(TypeError):
+        queue.claim()
+    queue.lease_seconds = 60
+    assert queue.claim().shipment_id == '1'  # type: ignore
+
+@patch("lib.metrics.Exporter")
+def test_JobQueue_process_next(mocked_exporter: MagicMock, queue: JobQueue):
+    confirmation = models.ShipmentConfirmation(status=201, result_code="OK", message="Mocked message")
+    mocked_exporter.return_value.add_new_shipment.return_value = confirmation
+    job = queue.enqueue('1')
+    assert queue.process_next() is True
+    mocked_exporter.assert_called_with('1')
+    assert queue.get(job.job_id) == models.JobStatus(job_id=job.job_id, shipment_id='1', status='done', attempts=1, result=confirmation)
+    assert queue.process_next() is False
+
+@patch("lib.metrics.Exporter")
+def test_JobQueue_process_next_error(mocked_exporter: MagicMock, queue: JobQueue):
+    mocked_exporter.side_effect = HTTPException(status_code=404, detail={"error": True, "error_description": "Mocked error message"})
+    job = queue.enqueue('1')
+    queue.process_next()
+    result = queue.get(job.job_id)
+    assert result.status == 'failed'  # type: ignore
+    assert result.result == models.ShipmentConfirmation(status=404, result_code="Error", message="Mocked error message")  # type: ignore
+
+@patch("lib.metrics.Exporter")
+def test_JobQueue_process_next_in_progress(mocked_exporter: MagicMock, queue: JobQueue, mocked_idempotency_cache: MagicMock):
+    in_progress = models.ShipmentConfirmation(status=409, result_code="InProgress", message="Mocked in progress")
+    mocked_idempotency_cache.run.side_effect = HTTPException(status_code=409, detail={"model": in_progress.dict()})
+    job = queue.enqueue('1')
+    other_job = queue.enqueue('2')
+    assert queue.process_next() is True
+    assert queue.get(job.job_id) == models.JobStatus(job_id=job.job_id, shipment_id='1', status='queued', attempts=0)
+    mocked_idempotency_cache.run.side_effect = lambda shipment_id, send_shipment: send_shipment()
+    mocked_exporter.return_value.add_new_shipment.return_value = models.ShipmentConfirmation(status=201)
+    assert queue.process_next() is True
+    assert queue.get(other_job.job_id).status == 'done'  # type: ignore
+    assert queue.get(job.job_id).status == 'queued'  # type: ignore
+    assert queue.process_next() is True
+    assert queue.get(job.job_id).status == 'done'  # type: ignore
+
+@patch("lib.metrics.Exporter")
+def test_JobQueue_workers(mocked_exporter: MagicMock, queue: JobQueue):
+    mocked_exporter.return_value.add_new_shipment.return_value = models.ShipmentConfirmation(status=201)
+    jobs = [queue.enqueue(str(number)) for number in range(5)]
+    queue.start(workers=2)
+    try:
+        for _ in range(500):
+            if all(queue.get(job.job_id).status == 'done' for job in jobs):  # type: ignore
+                break
+            queue._wakeup.wait(0.01)
+    finally:
+        queue.stop()
+    assert [queue.get(job.job_id).status for job in jobs] == ['done'] * 5  # type: ignore
+    assert mocked_exporter.call_count == 5
+
+@patch("lib.jobs.sentry_sdk.capture_exception")
+def test_JobQueue_worker_database_error(mocked_capture_exception: MagicMock, tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "not existing dir" / "jobs.db"), poll_seconds=0.01)
+    queue.start(workers=1)
+    queue._wakeup.wait(0.05)
+    queue.stop()
+    assert mocked_capture_exception.called
+
+def test_JobQueue_enabled(tmp_path):
+    assert JobQueue(db_path=str(tmp_path / "jobs.db"), workers=0).enabled is False
+    assert JobQueue(db_path=str(tmp_path / "jobs.db"), workers=1).enabled is True
+
+def test_JobQueue_start_disabled(tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.db"), workers=0)
+    queue.start()
+    assert queue._workers == []
+
+def test_JobQueue_claim_idle_without_write_lock(queue: JobQueue):
+    queue.enqueue('1')
+    queue.claim()
+    other_connection = queue._connect()
+    other_connection.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.perf_counter()
+        assert queue.claim() is None
+        assert time.perf_counter() - started < 1
+    finally:
+        other_connection.execute("ROLLBACK")
+        other_connection.close()
+
+def test_JobQueue_claim_max_attempts(queue: JobQueue):
+    queue.max_attempts = 2
+    job = queue.enqueue('1')
+    with patch("lib.jobs.time.time") as mocked_time:
+        for now in [1, 10 ** 6, 10 ** 7]:
+            mocked_time.return_value = now
+            claimed = queue.claim()
+        assert claimed is None
+    result = queue.get(job.job_id)
+    assert result.status == 'failed'  # type: ignore
+    assert result.attempts == 2  # type: ignore
+    assert result.result.message == "Job stopped after 2 attempts"  # type: ignore
+
+def test_JobQueue_renew(queue: JobQueue):
+    job = queue.enqueue('1')
+    queue.claim()
+    with patch("lib.jobs.time.time") as mocked_time:
+        mocked_time.return_value = 10 ** 6
+        queue.renew(job.job_id)
+        mocked_time.return_value = 10 ** 6 + 30
+        assert queue.claim() is None
+
+@patch("lib.metrics.Exporter")
+def test_JobQueue_process_next_renews_lease(mocked_exporter: MagicMock, queue: JobQueue):
+    queue.lease_seconds = 0.03
+    renewed = []
+    queue.renew = renewed.append  # type: ignore
+    def add_new_shipment():
+        time.sleep(0.1)
+        return models.ShipmentConfirmation(status=201)
+    mocked_exporter.return_value.add_new_shipment.side_effect = add_new_shipment
+    job = queue.enqueue('1')
+    queue.process_next()
+    assert renewed and set(renewed) == {job.job_id}
+
+@patch("lib.jobs.sentry_sdk.capture_exception")
+def test_JobQueue_renew_until_error(mocked_capture_exception: MagicMock, queue: JobQueue):
+    queue.lease_seconds = 0.03
+    queue.renew = MagicMock(side_effect=sqlite3.OperationalError("Mocked error"))  # type: ignore
+    finished = threading.Event()
+    threading.Timer(0.05, finished.set).start()
+    queue._renew_until('abc', finished)
+    assert mocked_capture_exception.called
+
+@patch("lib.jobs.sentry_sdk.capture_exception")
+def test_JobQueue_worker_database_error_backoff(mocked_capture_exception: MagicMock, tmp_path):
+    queue = JobQueue(db_path=str(tmp_path / "jobs.db"), poll_seconds=0.001, max_poll_seconds=0.004)
+    calls = []
+    def process_next():
+        calls.append(1)
+        if len(calls) == 6:
+            return False
+        if len(calls) >= 10:
+            queue._stop.set()
+        raise sqlite3.OperationalError("Mocked error")
+    queue.process_next = process_next  # type: ignore
+    queue._run_worker()
+    assert mocked_capture_exception.call_count == 2
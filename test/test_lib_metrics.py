@@ -0,0 +1,90 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+from lib import metrics, tracing
+import models
+
+
+class GLS(object):
+    pass
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_timed():
+    before = sample("tms_stage_duration_seconds_count", {"stage": "Mocked stage"})
+    with metrics.timed("Mocked stage"):
+        pass
+    assert sample("tms_stage_duration_seconds_count", {"stage": "Mocked stage"}) == before + 1
+
+def test_timed_error():
+    before = sample("tms_stage_duration_seconds_count", {"stage": "Mocked stage"})
+    with pytest.raises(ValueError):
+        with metrics.timed("Mocked stage"):
+            raise ValueError("Mocked error")
+    assert sample("tms_stage_duration_seconds_count", {"stage": "Mocked stage"}) == before + 1
+
+def test_send_shipment():
+    exporter_object = MagicMock()
+    exporter_object.carrier_exporter = GLS()
+    exporter_object.add_new_shipment.return_value = models.ShipmentConfirmation(status=201, result_code="Mocked OK")
+    before = sample("tms_shipments_total", {"carrier": "GLS", "result_code": "Mocked OK"})
+    assert metrics.send_shipment(exporter_object) == models.ShipmentConfirmation(status=201, result_code="Mocked OK")
+    assert sample("tms_shipments_total", {"carrier": "GLS", "result_code": "Mocked OK"}) == before + 1
+
+def test_send_shipment_no_result_code():
+    exporter_object = MagicMock()
+    exporter_object.carrier_exporter = GLS()
+    exporter_object.add_new_shipment.return_value = models.ShipmentConfirmation(status=299)
+    metrics.send_shipment(exporter_object)
+    assert sample("tms_shipments_total", {"carrier": "GLS", "result_code": "299"}) >= 1
+
+@pytest.mark.parametrize("error, result_code", [
+    (HTTPException(status_code=400, detail={"model": {"status": 418, "result_code": "Mocked Error"}}), "Mocked Error"),
+    (HTTPException(status_code=400, detail={"model": {"status": 419, "result_code": ""}}), "419"),
+    (HTTPException(status_code=409, detail={"error": True, "error_description": "Mocked error"}), "409"),
+    (ValueError("Mocked error"), "Exception"),
+])
+def test_send_shipment_error(error, result_code):
+    exporter_object = MagicMock()
+    exporter_object.carrier_exporter = GLS()
+    exporter_object.add_new_shipment.side_effect = error
+    before = sample("tms_shipments_total", {"carrier": "GLS", "result_code": result_code})
+    with pytest.raises(type(error)):
+        metrics.send_shipment(exporter_object)
+    assert sample("tms_shipments_total", {"carrier": "GLS", "result_code": result_code}) == before + 1
+
+def test_render(monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    with metrics.timed("Mocked stage"):
+        pass
+    content, content_type = metrics.render()
+    assert b'tms_stage_duration_seconds_count{stage="Mocked stage"}' in content
+    assert content_type.startswith("text/plain")
+
+@patch("lib.metrics.multiprocess.MultiProcessCollector")
+def test_render_multiprocess(mocked_collector: MagicMock, monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    content, _ = metrics.render()
+    mocked_collector.assert_called_once()
+    assert b"tms_stage_duration_seconds" not in content
+
+def test_send_shipment_traced():
+    exporter_object = MagicMock()
+    exporter_object.carrier_exporter = GLS()
+    exporter_object.add_new_shipment.return_value = models.ShipmentConfirmation(status=201, result_code="Mocked OK")
+    with tracing.trace("123456", "Mocked request", sample_rate=1):
+        metrics.send_shipment(exporter_object)
+    span = tracing.find_traces("123456")[0].root.children[0]
+    assert span.name == "add_new_shipment"
+    assert span.attributes == {"carrier": "GLS", "result_code": "Mocked OK"}
+
+@patch("lib.metrics.Exporter")
+def test_send_new_shipment(mocked_exporter: MagicMock):
+    mocked_exporter.return_value.carrier_exporter = GLS()
+    mocked_exporter.return_value.add_new_shipment.return_value = models.ShipmentConfirmation(status=201, result_code="Mocked OK")
+    before = sample("tms_stage_duration_seconds_count", {"stage": "exporter_init"})
+    assert metrics.send_new_shipment("123456") == models.ShipmentConfirmation(status=201, result_code="Mocked OK")
+    mocked_exporter.assert_called_with("123456")
+    assert sample("tms_stage_duration_seconds_count", {"stage": "exporter_init"}) == before + 1
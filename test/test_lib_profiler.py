@@ -0,0 +1,90 @@
+import pytest
+import threading
+import time
+from unittest.mock import patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from lib import profiler
+
+
+def busy_wait(seconds: float):
+    finish = time.perf_counter() + seconds
+    while time.perf_counter() < finish:
+        pass
+
+@pytest.fixture
+def profiled_app(tmp_path):
+    inner_app = FastAPI()
+
+    @inner_app.get("/slow")
+    def slow():
+        with profiler.attach():
+            busy_wait(0.1)
+        return {"ok": True}
+
+    app = profiler.ProfilerMiddleware(inner_app, token="secret", directory=str(tmp_path / "profiles"), interval=0.001, min_spacing=60)
+    return TestClient(app), tmp_path / "profiles"
+
+def test_attach_not_profiled():
+    with profiler.attach():
+        pass
+    assert profiler._current_sampler.get() is None
+
+def test_Sampler():
+    sampler = profiler.Sampler(interval=0.001)
+    sampler.start()
+    def work():
+        with patch.object(profiler, "_current_sampler") as mocked_current_sampler:
+            mocked_current_sampler.get.return_value = sampler
+            with profiler.attach():
+                busy_wait(0.1)
+    worker = threading.Thread(target=work)
+    worker.start()
+    worker.join()
+    sampler.stop()
+    assert sampler.thread_ids == set()
+    assert "busy_wait (test/test_lib_profiler.py:" in sampler.folded()
+    assert sampler.folded().splitlines()[0].rsplit(" ", 1)[1].isdigit()
+
+def test_ProfilerMiddleware_not_authorized(profiled_app):
+    client, directory = profiled_app
+    for headers, url in [({}, "/slow"), ({"x-tms-profile": "wrong"}, "/slow"), ({}, "/slow?profile=wrong"), ({"x-tms-profile": b"caf\xe9"}, "/slow"), ({}, "/slow?profile=%C5%82"), ({}, "/slow?profile=caf%E9")]:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert "x-tms-profile-file" not in response.headers
+    assert not directory.exists()
+
+def test_ProfilerMiddleware_disabled_without_token(tmp_path):
+    app = FastAPI()
+    client = TestClient(profiler.ProfilerMiddleware(app, token="", directory=str(tmp_path)))
+    response = client.get("/docs", headers={"x-tms-profile": ""})
+    assert "x-tms-profile-file" not in response.headers
+
+def test_ProfilerMiddleware_header(profiled_app):
+    client, directory = profiled_app
+    response = client.get("/slow", headers={"x-tms-profile": "secret"})
+    assert response.json() == {"ok": True}
+    profile_files = list(directory.iterdir())
+    assert [str(profile_file) for profile_file in profile_files] == [response.headers["x-tms-profile-file"]]
+    assert profile_files[0].name.endswith("-slow.folded")
+    assert "busy_wait" in profile_files[0].read_text()
+
+def test_ProfilerMiddleware_query_and_rate_limit(profiled_app):
+    client, directory = profiled_app
+    first = client.get("/slow?profile=secret")
+    second = client.get("/slow?profile=secret")
+    assert "x-tms-profile-file" in first.headers
+    assert "x-tms-profile-file" not in second.headers
+    assert len(list(directory.iterdir())) == 1
+
+def test_ProfilerMiddleware_one_profile_at_time(tmp_path):
+    middleware = profiler.ProfilerMiddleware(FastAPI(), token="secret", directory=str(tmp_path), min_spacing=0)
+    assert middleware._acquire() is True
+    assert middleware._acquire() is False
+    middleware._lock.release()
+    assert middleware._acquire() is True
+
+def test_ProfilerMiddleware_file_name_root(tmp_path):
+    middleware = profiler.ProfilerMiddleware(FastAPI(), token="secret", directory=str(tmp_path))
+    assert middleware._file_name("/").endswith("-root.folded")
+    assert middleware._file_name("/jobs/../x y").endswith("-jobs_.._x_y.folded")
@@ -0,0 +1,117 @@
+import pytest
+from unittest.mock import patch, MagicMock
+import sentry_sdk
+from sentry_sdk.transport import Transport
+from lib import tracing
+
+
+@pytest.fixture(autouse=True)
+def clear_traces():
+    tracing._traces.clear()
+    yield
+    tracing._traces.clear()
+
+def test_span_not_traced():
+    with tracing.span("Mocked span", rows=1) as current:
+        current.set("rows", 2)
+    assert current is tracing.NOOP_SPAN
+    assert tracing.find_traces() == []
+
+def test_trace_not_sampled():
+    with tracing.trace("123456", "Mocked request") as current:
+        with tracing.span("Mocked span"):
+            pass
+    assert current is tracing.NOOP_SPAN
+    assert tracing.find_traces() == []
+
+@patch("lib.tracing.random.random")
+def test_trace_sample_rate(mocked_random: MagicMock):
+    mocked_random.return_value = 0.5
+    with tracing.trace("1", "Mocked request", sample_rate=0.4):
+        pass
+    with tracing.trace("2", "Mocked request", sample_rate=0.6):
+        pass
+    assert [stored.shipment_id for stored in tracing.find_traces()] == ['2']
+
+def test_trace():
+    with tracing.trace("123456", "Mocked request", sample_rate=1):
+        with tracing.span("exporter_init", carrier="GLS") as current:
+            current.set("rows", 3)
+            with tracing.span("fetch_data"):
+                pass
+        with tracing.span("add_new_shipment"):
+            pass
+    traces = tracing.find_traces("123456")
+    assert len(traces) == 1
+    root = traces[0].root
+    assert root.name == "Mocked request"
+    assert root.attributes == {"shipment_id": "123456"}
+    assert [child.name for child in root.children] == ["exporter_init", "add_new_shipment"]
+    assert root.children[0].attributes == {"carrier": "GLS", "rows": 3}
+    assert root.children[0].children[0].name == "fetch_data"
+    assert root.duration_ms >= root.children[0].duration_ms
+
+def test_trace_error():
+    with pytest.raises(ValueError):
+        with tracing.trace("123456", "Mocked request", sample_rate=1):
+            with tracing.span("Mocked span"):
+                raise ValueError("Mocked error")
+    root = tracing.find_traces()[0].root
+    assert root.error == "ValueError('Mocked error')"
+    assert root.children[0].error == "ValueError('Mocked error')"
+
+def test_trace_nested():
+    with tracing.trace("123456", "Mocked request", sample_rate=1):
+        with tracing.trace("123456", "Mocked nested request", sample_rate=1):
+            pass
+    traces = tracing.find_traces()
+    assert len(traces) == 1
+    assert traces[0].root.children[0].name == "Mocked nested request"
+
+def test_find_traces():
+    for shipment_id in ['1', '2', '1']:
+        with tracing.trace(shipment_id, "Mocked request", sample_rate=1):
+            pass
+    assert [stored.shipment_id for stored in tracing.find_traces()] == ['1', '2', '1']
+    assert len(tracing.find_traces('1')) == 2
+    assert tracing.find_traces('3') == []
+
+@patch("lib.tracing.TRACE_TO_SENTRY", True)
+@patch("lib.tracing.sentry_sdk.start_transaction")
+def test_trace_to_sentry(mocked_start_transaction: MagicMock):
+    transaction = mocked_start_transaction.return_value
+    with tracing.trace("123456", "Mocked request", sample_rate=1):
+        with tracing.span("Mocked span", carrier="GLS"):
+            pass
+    mocked_start_transaction.assert_called_with(op="shipment", name="Mocked request", sampled=True)
+    transaction.set_tag.assert_called_with("shipment_id", "123456")
+    transaction.start_child.assert_called_with(op="Mocked span")
+    transaction.start_child.return_value.set_data.assert_called_with("carrier", "GLS")
+    transaction.start_child.return_value.finish.assert_called_once()
+    transaction.finish.assert_called_once()
+
+class CapturingTransport(Transport):
+    def __init__(self, options=None) -> None:
+        super().__init__(options)
+        self.envelopes = []
+
+    def capture_event(self, event) -> None:  # pragma: no cover
+        pass
+
+    def capture_envelope(self, envelope) -> None:
+        self.envelopes.append(envelope)
+
+@patch("lib.tracing.TRACE_TO_SENTRY", True)
+def test_trace_to_sentry_sent():
+    transport = CapturingTransport()
+    client = sentry_sdk.Client(dsn="https://key@sentry.invalid/1", transport=transport, traces_sample_rate=0)
+    with sentry_sdk.Hub(client):
+        with tracing.trace("123456", "Mocked request", sample_rate=1):
+            with tracing.span("Mocked span"):
+                pass
+    client.flush()
+    transactions = [item.payload.json for envelope in transport.envelopes for item in envelope.items if item.type == "transaction"]
+    assert len(transactions) == 1
+    assert transactions[0]["transaction"] == "Mocked request"
+    assert transactions[0]["tags"]["shipment_id"] == "123456"
+    assert [child["op"] for child in transactions[0]["spans"]] == ["Mocked span"]
@@ -11,7 +11,7 @@ def test_docs():
     assert response.status_code == 200
     assert "<title>Transportation management system API - Swagger UI</title>" in response.text
 
-@patch("main.Exporter")
+@patch("lib.metrics.Exporter")
 def test_get_order_data(mocked_exporter: MagicMock):
     exporter_object = MagicMock()
     exporter_object.get_shipment_data.return_value = models.CarrierResults(success = True, message = {"msg": "This is mocked order data"})
@@ -19,8 +19,10 @@ def test_get_order_data(mocked_exporter: MagicMock):
     response = client.get("/get_order_data?shipment_id=1")
     assert response.json() == {'message': {'msg': 'This is mocked order data'}, 'success': True}
 
-@patch("main.Exporter")
-def test_addShipment(mocked_exporter: MagicMock):
+@patch("main.idempotency_cache")
+@patch("lib.metrics.Exporter")
+def test_addShipment(mocked_exporter: MagicMock, mocked_idempotency_cache: MagicMock):
+    mocked_idempotency_cache.run.side_effect = lambda shipment_id, send_shipment: send_shipment()
     exporter_object = MagicMock()
     exporter_object.add_new_shipment.return_value = models.ShipmentConfirmation(status = 201, result_code = "OK", message = "This is mocked order data")
     mocked_exporter.return_value = exporter_object
@@ -31,3 +33,67 @@ def test_addShipment(mocked_exporter: MagicMock):
           'result_code': 'OK',
           'status': 201}
     assert response.json() == expected_response
+
+@patch("main.add_shipments")
+def test_addShipments(mocked_add_shipments: MagicMock):
+    mocked_add_shipments.return_value = [
+        models.BatchShipmentResult(shipment_id="1", confirmation=models.ShipmentConfirmation(status=201, result_code="OK", message="Mocked message"))
+    ]
+    response = client.post("/addShipments", json=["1", "2"])
+    mocked_add_shipments.assert_called_with(["1", "2"])
+    expected_response = [{'shipment_id': '1',
+          'confirmation': {'data': None,
+            'message': 'Mocked message',
+            'meta': None,
+            'result_code': 'OK',
+            'status': 201}}]
+    assert response.json() == expected_response
+
+@patch("main.job_queue")
+def test_addShipment_async_mode(mocked_job_queue: MagicMock):
+    mocked_job_queue.enqueue.return_value = models.JobStatus(job_id="abc", shipment_id="1", status="queued")
+    response = client.post("/addShipment?shipment_id=1&async_mode=true")
+    mocked_job_queue.enqueue.assert_called_with("1")
+    assert response.status_code == 202
+    assert response.json() == {'job_id': 'abc', 'shipment_id': '1', 'status': 'queued', 'attempts': 0, 'result': None}
+
+@patch("main.job_queue")
+def test_addShipment_async_mode_disabled(mocked_job_queue: MagicMock):
+    mocked_job_queue.enabled = False
+    response = client.post("/addShipment?shipment_id=1&async_mode=true")
+    assert response.status_code == 400
+    assert response.json() == {'detail': {'error': True, 'error_description': 'Async mode disabled, set job_workers to enable it'}}
+    mocked_job_queue.enqueue.assert_not_called()
+
+@patch("main.job_queue")
+def test_job_workers_startup_shutdown(mocked_job_queue: MagicMock):
+    with TestClient(app):
+        mocked_job_queue.start.assert_called_once()
+        mocked_job_queue.stop.assert_not_called()
+    mocked_job_queue.stop.assert_called_once()
+
+@patch("main.job_queue")
+def test_get_job(mocked_job_queue: MagicMock):
+    mocked_job_queue.get.return_value = models.JobStatus(job_id="abc", shipment_id="1", status="done", attempts=1, result=models.ShipmentConfirmation(status=201, result_code="OK"))
+    response = client.get("/jobs/abc")
+    mocked_job_queue.get.assert_called_with("abc")
+    assert response.json()['result']['status'] == 201
+
+@patch("main.job_queue")
+def test_get_job_not_found(mocked_job_queue: MagicMock):
+    mocked_job_queue.get.return_value = None
+    response = client.get("/jobs/abc")
+    assert response.status_code == 404
+    assert response.json() == {'detail': {'error': True, 'error_description': 'Job abc not found'}}
+
+def test_metrics():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "tms_stage_duration_seconds" in response.text
+
+@patch("main.tracing.find_traces")
+def test_get_traces(mocked_find_traces: MagicMock):
+    mocked_find_traces.return_value = [models.Trace(trace_id="abc", shipment_id="1", root=models.SpanData(name="addShipment", start=1, duration_ms=2))]
+    response = client.get("/debug/traces?shipment_id=1")
+    mocked_find_traces.assert_called_with("1")
+    assert response.json() == [{'trace_id': 'abc', 'shipment_id': '1', 'root': {'name': 'addShipment', 'start': 1.0, 'duration_ms': 2.0, 'attributes': {}, 'error': None, 'children': []}}]